@@ -0,0 +1,217 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from fastapi import Depends, HTTPException, Request, status
+from .auth import get_current_user
+from .cache import ABSENT, CacheTTL
+
+# Seau de jetons par client : capacité maximale et nombre de jetons rechargés par seconde
+RATE_LIMIT_CAPACITE = float(os.getenv("RATE_LIMIT_CAPACITE", 60))
+RATE_LIMIT_RECHARGE = float(os.getenv("RATE_LIMIT_RECHARGE", 1))
+
+# Fichier SQLite partagé par les workers d'une même machine (par défaut les seaux restent en mémoire du processus)
+RATE_LIMIT_BACKEND_PATH = os.getenv("RATE_LIMIT_BACKEND_PATH")
+
+# En-tête portant l'adresse du client derrière un proxy de confiance (ex : X-Forwarded-For), sinon l'adresse de la connexion
+RATE_LIMIT_EN_TETE_CLIENT = os.getenv("RATE_LIMIT_EN_TETE_CLIENT")
+
+# Nombre maximal de seaux conservés et intervalle (en secondes) de purge des seaux pleins dans SQLite
+RATE_LIMIT_SEAUX_MAX = int(os.getenv("RATE_LIMIT_SEAUX_MAX", 10000))
+RATE_LIMIT_NETTOYAGE = float(os.getenv("RATE_LIMIT_NETTOYAGE", 60))
+
+# Classes d'endpoints soumises à la limitation de débit
+ADMISSION_CLASSES = ("leger", "lourd")
+
+# Nombre maximal de requêtes simultanées par classe d'endpoints. La classe "lourd" n'a pas de plafond ici :
+# ses calculs passent par le limiteur de execution.py (EXECUTION_LIMITE_PAR_ENDPOINT), seul en charge de leur concurrence
+ADMISSION_LIMITES = {
+    "leger": int(os.getenv("ADMISSION_LIMITE_LEGER", 32)),
+}
+
+# Attente maximale (en secondes) d'une place sur un endpoint léger avant de délester la requête avec une 503
+ADMISSION_ATTENTE_MAX = float(os.getenv("ADMISSION_ATTENTE_MAX", 1))
+
+
+def _duree_recharge(capacite: float, recharge: float):
+    # Au-delà de cette durée sans requête, un seau est de nouveau plein : le conserver est inutile
+    return capacite / recharge if recharge > 0 else math.inf
+
+
+# ---- Seaux de jetons conservés en mémoire du processus, dans un cache borné qui oublie les seaux rechargés
+class SeauxMemoire:
+    def __init__(self, capacite: float = RATE_LIMIT_CAPACITE, recharge: float = RATE_LIMIT_RECHARGE,
+                 taille_max: int = RATE_LIMIT_SEAUX_MAX):
+        self._seaux = CacheTTL(_duree_recharge(capacite, recharge), taille_max)
+        self._lock = threading.Lock()
+
+    def consommer(self, sujet: str, cout: float, capacite: float, recharge: float):
+        # Retourne 0 si les jetons ont été consommés, sinon le nombre de secondes à attendre
+        maintenant = time.monotonic()
+        with self._lock:
+            seau = self._seaux.obtenir(sujet)
+            jetons, maj = seau if seau is not ABSENT else (capacite, maintenant)
+            jetons = min(capacite, jetons + (maintenant - maj) * recharge)
+            attente = _consommer(jetons, cout, recharge)
+            self._seaux.enregistrer(sujet, (jetons - cout if attente == 0 else jetons, maintenant))
+        return attente
+
+    def metriques(self):
+        return {"seaux": self._seaux.metriques()["entrees"]}
+
+
+# ---- Seaux de jetons partagés entre les workers via un fichier SQLite local
+class SeauxSQLite:
+    def __init__(self, chemin: str):
+        self.chemin = chemin
+        self.erreurs = 0
+        self._dernier_nettoyage = 0.0
+        with self._connexion() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS seaux (sujet TEXT PRIMARY KEY, jetons REAL NOT NULL, maj REAL NOT NULL)")
+
+    def _connexion(self):
+        return sqlite3.connect(self.chemin, timeout=5, isolation_level=None)
+
+    def consommer(self, sujet: str, cout: float, capacite: float, recharge: float):
+        try:
+            return self._consommer(sujet, cout, capacite, recharge)
+        except sqlite3.Error as erreur:
+            # Une panne du stockage partagé ne doit pas bloquer l'API : la requête est admise,
+            # les plafonds de concurrence continuent de protéger la base
+            self.erreurs += 1
+            print(f"Rate limit backend error, request allowed: {erreur}")
+            return 0
+
+    def metriques(self):
+        try:
+            with closing(self._connexion()) as conn:
+                seaux = conn.execute("SELECT COUNT(*) FROM seaux").fetchone()[0]
+        except sqlite3.Error:
+            seaux = None
+        return {"seaux": seaux, "erreurs": self.erreurs}
+
+    def _consommer(self, sujet: str, cout: float, capacite: float, recharge: float):
+        conn = self._connexion()
+        transaction = False
+        try:
+            # BEGIN IMMEDIATE verrouille la base en écriture : la lecture et la mise à jour sont atomiques entre workers
+            conn.execute("BEGIN IMMEDIATE")
+            transaction = True
+            maintenant = time.time()
+            ligne = conn.execute("SELECT jetons, maj FROM seaux WHERE sujet = ?", (sujet,)).fetchone()
+            jetons, maj = ligne if ligne else (capacite, maintenant)
+            jetons = min(capacite, jetons + (maintenant - maj) * recharge)
+            attente = _consommer(jetons, cout, recharge)
+            conn.execute(
+                "INSERT OR REPLACE INTO seaux (sujet, jetons, maj) VALUES (?, ?, ?)",
+                (sujet, jetons - cout if attente == 0 else jetons, maintenant)
+            )
+            if maintenant - self._dernier_nettoyage >= RATE_LIMIT_NETTOYAGE:
+                # Les seaux inactifs depuis plus que la durée de recharge sont pleins : on les supprime
+                conn.execute("DELETE FROM seaux WHERE maj < ?", (maintenant - _duree_recharge(capacite, recharge),))
+                self._dernier_nettoyage = maintenant
+            conn.execute("COMMIT")
+            return attente
+        except BaseException:
+            if transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+def _consommer(jetons: float, cout: float, recharge: float):
+    if jetons >= cout:
+        return 0
+    return (cout - jetons) / recharge if recharge > 0 else math.inf
+
+
+# ---- Limitation de débit par client et plafond de concurrence des endpoints légers
+class ControleAdmission:
+    def __init__(self, seaux=None, capacite: float = RATE_LIMIT_CAPACITE, recharge: float = RATE_LIMIT_RECHARGE,
+                 limites: dict = ADMISSION_LIMITES, attente_max: float = ADMISSION_ATTENTE_MAX):
+        self.seaux = seaux if seaux is not None else SeauxMemoire(capacite, recharge)
+        self.capacite = capacite
+        self.recharge = recharge
+        self.attente_max = attente_max
+        self.limites = dict(limites)
+        self._semaphores = {classe: threading.BoundedSemaphore(limite) for classe, limite in self.limites.items()}
+        self._lock = threading.Lock()
+        self.compteurs = {
+            classe: {"actifs": 0, "admises": 0, "rejetsDebit": 0, "rejetsSurcharge": 0, "attenteMaxSecondes": 0.0}
+            for classe in (*ADMISSION_CLASSES, *self.limites)
+        }
+
+    def verifier_debit(self, sujet: str, classe: str, cout: float):
+        attente = self.seaux.consommer(sujet, min(cout, self.capacite), self.capacite, self.recharge)
+        if attente > 0:
+            with self._lock:
+                self.compteurs[classe]["rejetsDebit"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Trop de requêtes, veuillez patienter avant de réessayer",
+                headers={"Retry-After": str(max(1, math.ceil(attente)))}
+            )
+
+    def entrer(self, classe: str):
+        # Retourne False si la classe n'a pas de plafond de concurrence ici : sortir() n'est alors pas à appeler
+        if classe not in self._semaphores:
+            return False
+        debut = time.monotonic()
+        obtenu = self._semaphores[classe].acquire(timeout=self.attente_max)
+        attente = time.monotonic() - debut
+        with self._lock:
+            compteurs = self.compteurs[classe]
+            compteurs["attenteMaxSecondes"] = max(compteurs["attenteMaxSecondes"], round(attente, 3))
+            if obtenu:
+                compteurs["actifs"] += 1
+                compteurs["admises"] += 1
+            else:
+                compteurs["rejetsSurcharge"] += 1
+        if not obtenu:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Le service est surchargé, veuillez réessayer plus tard",
+                headers={"Retry-After": str(max(1, math.ceil(self.attente_max)))}
+            )
+        return True
+
+    def sortir(self, classe: str):
+        self._semaphores[classe].release()
+        with self._lock:
+            self.compteurs[classe]["actifs"] -= 1
+
+    def metriques(self):
+        with self._lock:
+            classes = {classe: {"limite": self.limites.get(classe), **compteurs} for classe, compteurs in self.compteurs.items()}
+        return {**classes, "stockage": self.seaux.metriques()}
+
+
+controle_admission = ControleAdmission(SeauxSQLite(RATE_LIMIT_BACKEND_PATH) if RATE_LIMIT_BACKEND_PATH else None)
+
+
+def identifier_client(request: Request):
+    # L'API n'a qu'un compte (API_USERNAME) et un nouveau token s'obtient librement : le seau est donc
+    # rattaché à l'adresse du client, qu'il ne peut pas renouveler en se reconnectant
+    if RATE_LIMIT_EN_TETE_CLIENT:
+        en_tete = request.headers.get(RATE_LIMIT_EN_TETE_CLIENT)
+        if en_tete:
+            return en_tete.split(",")[0].strip()
+    return request.client.host if request.client else "inconnu"
+
+
+# ---- Dépendance FastAPI : le coût peut être fixe ou calculé à partir de la requête (ex : profondeur de généalogie)
+def admission(classe: str, cout=1):
+    def dependance(request: Request, current_user: str = Depends(get_current_user)):
+        sujet = identifier_client(request)
+        cout_requete = cout(request) if callable(cout) else cout
+        controle_admission.verifier_debit(sujet, classe, cout_requete)
+        plafonnee = controle_admission.entrer(classe)
+        try:
+            yield
+        finally:
+            if plafonnee:
+                controle_admission.sortir(classe)
+    return dependance
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Durée de vie (en secondes) et nombre maximal d'entrées des caches de réponses
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+CACHE_TAILLE_MAX = int(os.getenv("CACHE_TAILLE_MAX", 1000))
+
+# Taille de page maximale mise en cache sur /chevaux/ : les pages plus grandes sont toujours lues en base
+CACHE_TAILLE_PAGE_MAX = int(os.getenv("CACHE_TAILLE_PAGE_MAX", 100))
+
+# Valeur renvoyée par obtenir() quand la clé est absente ou expirée
+ABSENT = object()
+
+
+# ---- Cache LRU avec expiration des entrées
+class CacheTTL:
+    def __init__(self, ttl: int = CACHE_TTL, taille_max: int = CACHE_TAILLE_MAX):
+        self.ttl = ttl
+        self.taille_max = taille_max
+        self._entrees = OrderedDict()
+        self._lock = threading.Lock()
+        self.compteurs = {"succes": 0, "echecs": 0}
+
+    def obtenir(self, cle):
+        with self._lock:
+            entree = self._entrees.get(cle)
+            if entree is None or time.monotonic() - entree[0] >= self.ttl:
+                self._entrees.pop(cle, None)
+                self.compteurs["echecs"] += 1
+                return ABSENT
+            self._entrees.move_to_end(cle)
+            self.compteurs["succes"] += 1
+            return entree[1]
+
+    def enregistrer(self, cle, valeur):
+        with self._lock:
+            self._entrees[cle] = (time.monotonic(), valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+
+    def vider(self):
+        with self._lock:
+            self._entrees.clear()
+
+    def metriques(self):
+        with self._lock:
+            return {**self.compteurs, "entrees": len(self._entrees)}
+
+
+cache_stats = CacheTTL()
+cache_genealogies = CacheTTL()
+cache_pages = CacheTTL()
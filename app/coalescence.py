@@ -0,0 +1,77 @@
+import os
+import threading
+from fastapi import HTTPException, status
+
+# Délai maximal d'attente (en secondes) d'une requête qui attend le calcul d'une requête identique
+COALESCENCE_TIMEOUT = float(os.getenv("COALESCENCE_TIMEOUT", 30))
+
+
+# ---- Calcul en cours partagé entre les requêtes identiques
+class _AppelEnCours:
+    def __init__(self):
+        self.termine = threading.Event()
+        self.resultat = None
+        self.erreur = None
+        self.nombre_attentes = 0
+
+
+# ---- Regroupement des requêtes identiques concurrentes (single-flight)
+class Coalesceur:
+    def __init__(self, timeout: float = COALESCENCE_TIMEOUT):
+        self.timeout = timeout
+        self._appels = {}
+        self._lock = threading.Lock()
+        self.compteurs = {
+            "requetes": 0,
+            "calculs": 0,
+            "dedupliquees": 0,
+            "erreurs": 0,
+            "timeouts": 0,
+        }
+
+    def executer(self, cle, fonction, timeout: float = None):
+        with self._lock:
+            self.compteurs["requetes"] += 1
+            appel = self._appels.get(cle)
+            if appel is None:
+                appel = _AppelEnCours()
+                self._appels[cle] = appel
+                meneur = True
+                self.compteurs["calculs"] += 1
+            else:
+                appel.nombre_attentes += 1
+                meneur = False
+                self.compteurs["dedupliquees"] += 1
+
+        if meneur:
+            try:
+                appel.resultat = fonction()
+            except BaseException as erreur:
+                appel.erreur = erreur
+                with self._lock:
+                    self.compteurs["erreurs"] += 1
+                raise
+            finally:
+                # Les requêtes suivantes relancent un calcul frais une fois celui-ci terminé
+                with self._lock:
+                    self._appels.pop(cle, None)
+                appel.termine.set()
+            return appel.resultat
+
+        if not appel.termine.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self.compteurs["timeouts"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Le calcul partagé n'a pas abouti dans le délai imparti"
+            )
+        if appel.erreur is not None:
+            raise appel.erreur
+        return appel.resultat
+
+    def metriques(self):
+        with self._lock:
+            return {**self.compteurs, "enCours": len(self._appels)}
+
+
+coalesceur = Coalesceur()
@@ -0,0 +1,128 @@
+import os
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+from . import models
+from .cache import ABSENT, CacheTTL, CACHE_TAILLE_MAX
+
+# Les temps PMU (temps_obtenu, reduction_kilometrique) sont stockés en millisecondes
+MILLISECONDES_PAR_SECONDE = 1000.0
+
+# Tranches de distance (borne basse incluse, borne haute exclue) utilisées pour segmenter les vitesses
+TRANCHES_DISTANCE = [
+    (None, 2100, "courte"),
+    (2100, 2700, "moyenne"),
+    (2700, None, "longue"),
+]
+
+# Durée de vie des cellules du cube en secondes
+CUBE_VITESSES_TTL = int(os.getenv("CUBE_VITESSES_TTL", 3600))
+
+
+# ---- Expressions SQL communes au cube
+def _distance_effective():
+    # handicap_distance est la distance totale parcourue par le cheval (recul compris), à défaut celle de la course
+    return func.coalesce(models.ParticipationsAuxCourses.handicap_distance, models.Courses.distance)
+
+def _tranche_distance(distance):
+    conditions = [(distance < borne_haute, libelle) for _, borne_haute, libelle in TRANCHES_DISTANCE if borne_haute is not None]
+    return case(*conditions, else_=TRANCHES_DISTANCE[-1][2])
+
+
+# ---- Construction des cellules (nom, hippodrome, tranche, discipline) en une seule requête GROUP BY
+def calculer_cellules(db: Session, noms=None):
+    distance = _distance_effective()
+    tranche = _tranche_distance(distance).label("tranche_distance")
+    temps_valide = models.ParticipationsAuxCourses.temps_obtenu > 0
+    reduction_valide = models.ParticipationsAuxCourses.reduction_kilometrique > 0
+
+    vitesse_kmh = case(
+        (temps_valide, distance * 3.6 * MILLISECONDES_PAR_SECONDE / models.ParticipationsAuxCourses.temps_obtenu),
+        else_=None
+    )
+    reduction = case(
+        (reduction_valide, models.ParticipationsAuxCourses.reduction_kilometrique),
+        else_=None
+    )
+
+    query = (db.query(
+                models.ParticipationsAuxCourses.nom.label("nom"),
+                models.Reunion.code_hippodrome.label("code_hippodrome"),
+                tranche,
+                models.Courses.discipline.label("discipline"),
+                func.count(models.ParticipationsAuxCourses.id_participation).label("nombre_courses"),
+                func.count(vitesse_kmh).label("nombre_courses_chronometrees"),
+                func.avg(vitesse_kmh).label("vitesse_moyenne_kmh"),
+                func.max(vitesse_kmh).label("vitesse_max_kmh"),
+                func.avg(reduction).label("reduction_moyenne"),
+                func.min(reduction).label("meilleure_reduction"),
+             )
+             .join(models.Courses, models.Courses.id_course == models.ParticipationsAuxCourses.id_course)
+             .join(models.Reunion, models.Reunion.id_reunion == models.Courses.id_reunion)
+             .filter(models.ParticipationsAuxCourses.race == "TROTTEUR FRANCAIS")
+             .group_by(
+                models.ParticipationsAuxCourses.nom,
+                models.Reunion.code_hippodrome,
+                tranche,
+                models.Courses.discipline,
+             ))
+
+    if noms is not None:
+        query = query.filter(models.ParticipationsAuxCourses.nom.in_(list(noms)))
+
+    cellules = {}
+    for row in query.all():
+        cellules.setdefault(row.nom, []).append({
+            "codeHippodrome": row.code_hippodrome,
+            "trancheDistance": row.tranche_distance,
+            "discipline": row.discipline,
+            "nombreCourses": row.nombre_courses,
+            "nombreCoursesChronometrees": row.nombre_courses_chronometrees,
+            "vitesseMoyenneKmh": _arrondir(row.vitesse_moyenne_kmh),
+            "vitesseMaxKmh": _arrondir(row.vitesse_max_kmh),
+            "reductionKilometriqueMoyenne": _en_secondes(row.reduction_moyenne),
+            "meilleureReductionKilometrique": _en_secondes(row.meilleure_reduction),
+        })
+    return cellules
+
+def _arrondir(valeur):
+    return round(float(valeur), 2) if valeur is not None else None
+
+def _en_secondes(valeur):
+    return round(float(valeur) / MILLISECONDES_PAR_SECONDE, 2) if valeur is not None else None
+
+
+# ---- Moyenne globale pondérée par le nombre de courses chronométrées de chaque cellule
+def vitesse_moyenne_globale(cellules):
+    total = sum(c["nombreCoursesChronometrees"] for c in cellules if c["vitesseMoyenneKmh"] is not None)
+    if total == 0:
+        return 0.0
+    somme = sum(c["vitesseMoyenneKmh"] * c["nombreCoursesChronometrees"] for c in cellules if c["vitesseMoyenneKmh"] is not None)
+    return round(somme / total, 2)
+
+
+# ---- Cube des vitesses par cheval : cellules calculées à la demande (ou au préchauffage) et conservées dans un cache borné
+class CubeVitesses:
+    def __init__(self, ttl: int = CUBE_VITESSES_TTL, taille_max: int = CACHE_TAILLE_MAX):
+        self._cellules = CacheTTL(ttl, taille_max)
+
+    def obtenir(self, db: Session, nom: str):
+        cellules = self._cellules.obtenir(nom)
+        if cellules is not ABSENT:
+            return cellules
+        return self.precalculer(db, [nom]).get(nom, [])
+
+    def precalculer(self, db: Session, noms):
+        cellules = calculer_cellules(db, noms)
+        # Seuls les chevaux ayant des courses sont conservés : un nom inconnu ne crée pas d'entrée
+        for nom, cellules_cheval in cellules.items():
+            self._cellules.enregistrer(nom, cellules_cheval)
+        return cellules
+
+    def vider(self):
+        self._cellules.vider()
+
+    def metriques(self):
+        return self._cellules.metriques()
+
+
+cube_vitesses = CubeVitesses()
@@ -0,0 +1,78 @@
+import os
+import threading
+from fastapi import HTTPException, status
+
+# Nombre maximal de calculs lourds (pandas, validation des généalogies profondes) simultanés par endpoint
+EXECUTION_LIMITE_PAR_ENDPOINT = int(os.getenv("EXECUTION_LIMITE_PAR_ENDPOINT", max(1, (os.cpu_count() or 4) // 2)))
+
+# Durée maximale (en secondes) d'attente d'une place avant de rejeter la requête avec une 503
+EXECUTION_ATTENTE_MAX = float(os.getenv("EXECUTION_ATTENTE_MAX", 2))
+
+
+# ---- Limite de concurrence et compteurs d'un endpoint
+class _LimiteEndpoint:
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.semaphore = threading.BoundedSemaphore(limite)
+        self.compteurs = {
+            "actifs": 0,
+            "enAttente": 0,
+            "executes": 0,
+            "rejetes": 0,
+        }
+
+
+# ---- Limiteur des calculs lourds : au-delà de la limite d'un endpoint, les requêtes attendent puis sont rejetées
+class LimiteurCalcul:
+    def __init__(self, attente_max: float = EXECUTION_ATTENTE_MAX, limite_par_defaut: int = EXECUTION_LIMITE_PAR_ENDPOINT):
+        self.attente_max = attente_max
+        self.limite_par_defaut = limite_par_defaut
+        self._limites = {}
+        self._lock = threading.Lock()
+
+    def _limite(self, endpoint: str):
+        with self._lock:
+            if endpoint not in self._limites:
+                self._limites[endpoint] = _LimiteEndpoint(self.limite_par_defaut)
+            return self._limites[endpoint]
+
+    def configurer(self, endpoint: str, limite: int):
+        with self._lock:
+            self._limites[endpoint] = _LimiteEndpoint(limite)
+
+    def executer(self, endpoint: str, fonction):
+        limite = self._limite(endpoint)
+        with self._lock:
+            limite.compteurs["enAttente"] += 1
+        obtenu = limite.semaphore.acquire(timeout=self.attente_max)
+        with self._lock:
+            limite.compteurs["enAttente"] -= 1
+            if not obtenu:
+                limite.compteurs["rejetes"] += 1
+            else:
+                limite.compteurs["actifs"] += 1
+
+        if not obtenu:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Le service est surchargé, veuillez réessayer plus tard",
+                headers={"Retry-After": str(max(1, round(self.attente_max)))}
+            )
+
+        try:
+            return fonction()
+        finally:
+            limite.semaphore.release()
+            with self._lock:
+                limite.compteurs["actifs"] -= 1
+                limite.compteurs["executes"] += 1
+
+    def metriques(self):
+        with self._lock:
+            return {
+                endpoint: {"limite": limite.limite, **limite.compteurs}
+                for endpoint, limite in self._limites.items()
+            }
+
+
+limiteur_calcul = LimiteurCalcul()
@@ -1,15 +1,35 @@
 from fastapi import FastAPI, Depends, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import desc, or_, func
 from . import models, schemas, database
+from .cube_vitesses import cube_vitesses, vitesse_moyenne_globale
+from .coalescence import coalesceur
+from .execution import limiteur_calcul
+from .admission import admission, controle_admission
+from .cache import ABSENT, CACHE_TAILLE_PAGE_MAX, cache_stats, cache_genealogies, cache_pages
+from .prechauffage import (prechauffage, PRECHAUFFAGE_ACTIF, PRECHAUFFAGE_NOMBRE_CHEVAUX, PRECHAUFFAGE_PROFONDEUR,
+                           PRECHAUFFAGE_PAGES, PRECHAUFFAGE_TAILLE_PAGE)
 from .auth import get_current_user, auth_router
-from typing import List
+from typing import List, Optional, Set
+from contextlib import asynccontextmanager
 import pandas as pd
+import os
+
+# Cycle de vie de l'application : surveillance des réplicas en lecture et préchauffage des caches
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.routeur_lecture.demarrer()
+    if PRECHAUFFAGE_ACTIF:
+        prechauffage.demarrer(prechauffer_caches)
+    yield
+    database.routeur_lecture.arreter()
 
 # Créer l'application FastAPI avec des métadonnées personnalisées
 app = FastAPI(
+    lifespan=lifespan,
     docs_url="/",
     redoc_url="/docs",
     title="API de Gestion des Chevaux",
@@ -24,20 +44,48 @@ app.include_router(auth_router, prefix="/auth", tags=["Author"])
 # Configurer le répertoire des templates
 templates = Jinja2Templates(directory="templates")
 
-# Dépendance pour obtenir une session de base de données
+# Dépendance pour obtenir une session de base de données (réplica en lecture si disponible, tous les endpoints étant en lecture seule)
 def get_db():
-    db = database.SessionLocal()
+    db = database.routeur_lecture.session()
     try:
         yield db
     finally:
         db.close()
 
-# Fonction pour convertir le temps en secondes
-def convertir_temps_en_secondes(temps):
-    if not temps or temps == '0m 0s':
-        return None  # Valeur manquante pour les temps non disponibles
-    minutes, secondes = map(int, temps[:-1].split('m '))
-    return minutes * 60 + secondes
+# Nombre maximal de chevaux demandés dans un même lot
+TAILLE_MAX_LOT = int(os.getenv("TAILLE_MAX_LOT", 500))
+
+# Coût d'une généalogie pour la limitation de débit : il croît avec la profondeur demandée
+def cout_genealogie(request: Request):
+    try:
+        return 1 + max(0, int(request.path_params.get("depth", 1)))
+    except ValueError:
+        return 1
+
+# Description commune du paramètre fields des réponses partielles
+DESCRIPTION_FIELDS = "Liste des champs de la réponse à calculer et renvoyer, séparés par des virgules (par défaut tous les champs)"
+
+# Fonction pour valider la liste des champs demandés par le client
+def parse_fields(fields: Optional[str], schema):
+    if fields is None:
+        return None
+    champs = {champ.strip() for champ in fields.split(",") if champ.strip()}
+    if not champs:
+        raise HTTPException(status_code=400, detail="La liste des champs demandés est vide")
+    inconnus = champs - set(schema.model_fields)
+    if inconnus:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus : {', '.join(sorted(inconnus))}")
+    return champs
+
+# Fonction pour construire une réponse complète ou restreinte aux champs demandés
+def construire_reponse(schema, valeurs: dict, champs: Optional[Set[str]]):
+    if champs is None:
+        return schema(**valeurs)
+    return JSONResponse(content=jsonable_encoder({champ: valeurs[champ] for champ in schema.model_fields if champ in champs}))
+
+# Fonction pour extraire les champs demandés d'un cheval trotteur français
+def champs_infos(cheval, champs: Set[str]):
+    return {champ: getattr(cheval, colonne) for champ, colonne in schemas.COLONNES_INFOS.items() if champ in champs}
 
 
 # ------------------------------------------------------ Endpoint pour savoir si un cheval a une généalogie ou des stats -----------------------------------|
@@ -46,7 +94,8 @@ def convertir_temps_en_secondes(temps):
     response_model=schemas.StatsIfceResponse,
     summary="Permet de savoir si un cheval a des données dans la table IFCE et/ou dans la table des courses PMU",
     description="Récupère quelques informations d'une table ou de l'autre ou des deux suivant ce qui est dispo",
-    tags=["Consultation des informations chevaux"]
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("leger"))]
 )
 def get_stats_ifce(nomCheval: str, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
 
@@ -88,41 +137,76 @@ def get_stats_ifce(nomCheval: str, db: Session = Depends(get_db), current_user:
     response_model=schemas.PaginationResponse,
     summary="Lister les chevaux de race trotteur français avec pagination",
     description="Récupère une liste de chevaux trotteur français avec pagination. Permet de spécifier la page et la taille de page pour naviguer à travers les résultats.",
-    tags=["Consultation des informations chevaux"]
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("leger"))]
 )
-def get_chevaux(page: int = Query(1, ge=1), page_size: int = Query(10, ge=1), db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+def get_chevaux(page: int = Query(1, ge=1), page_size: int = Query(10, ge=1), fields: Optional[str] = Query(None, description=DESCRIPTION_FIELDS), db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    champs = parse_fields(fields, schemas.InfosResponse)
+
+    page_chevaux = get_page_chevaux(page, page_size, db, champs)
+    if page_chevaux is None:
+        raise HTTPException(status_code=404, detail="Aucun cheval trouvé")
+
+    return reponse_page_chevaux(page, page_size, *page_chevaux, champs)
+
+def get_page_chevaux(page: int, page_size: int, db: Session, champs: Optional[Set[str]] = None):
+    # Partagé par l'endpoint et le préchauffage : retourne (total_results, resultats), ou None si la page est vide
+
+    # Page déjà en cache (préchauffage ou requête précédente), seules les pages de taille raisonnable sont conservées
+    page_en_cache = cache_pages.obtenir((page, page_size)) if page_size <= CACHE_TAILLE_PAGE_MAX else ABSENT
+    if page_en_cache is not ABSENT:
+        return page_en_cache
+
     # Calculer l'offset et la limite
     offset = (page - 1) * page_size
 
-    # Requête pour obtenir les résultats paginés avec un ordre spécifique
-    chevaux = db.query(models.ChevauxTrotteurFrancais).order_by(models.ChevauxTrotteurFrancais.id_tf).offset(offset).limit(page_size).all()
+    # Requête pour obtenir les résultats paginés avec un ordre spécifique (seules les colonnes demandées sont chargées)
+    query = db.query(models.ChevauxTrotteurFrancais)
+    if champs is not None:
+        query = query.options(load_only(*[getattr(models.ChevauxTrotteurFrancais, schemas.COLONNES_INFOS[champ]) for champ in champs]))
+    chevaux = query.order_by(models.ChevauxTrotteurFrancais.id_tf).offset(offset).limit(page_size).all()
+
+    if not chevaux:
+        return None
 
     # Requête pour obtenir le nombre total de résultats
     total_results = db.query(models.ChevauxTrotteurFrancais).count()
 
-    if not chevaux:
-        raise HTTPException(status_code=404, detail="Aucun cheval trouvé")
+    # Réponse partielle : seuls les champs demandés sont chargés, la page n'est pas mise en cache
+    if champs is not None:
+        return total_results, [champs_infos(cheval, champs) for cheval in chevaux]
 
+    # Convertir les résultats en objets Pydantic et conserver la page complète en cache
+    page_chevaux = (total_results, [schemas.InfosResponse.from_orm(cheval) for cheval in chevaux])
+    if page_size <= CACHE_TAILLE_PAGE_MAX:
+        cache_pages.enregistrer((page, page_size), page_chevaux)
+    return page_chevaux
+
+def reponse_page_chevaux(page: int, page_size: int, total_results: int, resultats: list, champs: Optional[Set[str]]):
     total_pages = (total_results + page_size - 1) // page_size  # Calcul du nombre total de pages
 
-    # Convertir les résultats en objets Pydantic
-    chevaux_pydantic = [schemas.InfosResponse.from_orm(cheval) for cheval in chevaux]
+    if champs is None:
+        return schemas.PaginationResponse(
+            total_results=total_results,
+            total_pages=total_pages,
+            current_page=page,
+            page_size=page_size,
+            results=resultats
+        )
 
-    return schemas.PaginationResponse(
-        total_results=total_results,
-        total_pages=total_pages,
-        current_page=page,
-        page_size=page_size,
-        results=chevaux_pydantic
-    )
+    return JSONResponse(content=jsonable_encoder({
+        "total_results": total_results,
+        "total_pages": total_pages,
+        "current_page": page,
+        "page_size": page_size,
+        "results": [resultat.model_dump(include=champs) if isinstance(resultat, schemas.InfosResponse) else resultat for resultat in resultats],
+    }))
 # ----------------------------------------------------------------------------------------------------------------------------------------------------------|
 
 
 
 # ------------------------------------------------------ Endpoint pour récupérer les infos d'un cheval -----------------------------------------------------|
-def get_complete_info(idCheval: int, db: Session):
-
-    cheval = db.query(models.ChevauxTrotteurFrancais).filter(models.ChevauxTrotteurFrancais.id_tf == idCheval).first()
+def get_complete_info(cheval: models.ChevauxTrotteurFrancais):
 
     return schemas.InfosResponse(
         id = cheval.id_tf,
@@ -140,104 +224,180 @@ def get_complete_info(idCheval: int, db: Session):
     response_model=schemas.InfosResponse,
     summary="Obtenir les informations d'un cheval de la race trotteur français",
     description="Récupère les informations détaillées d'un cheval spécifique en utilisant son identifiant.",
-    tags=["Consultation des informations chevaux"]
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("leger"))]
 )
 def get_infos_cheval(idCheval: int, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
 
     cheval = db.query(models.ChevauxTrotteurFrancais).filter(models.ChevauxTrotteurFrancais.id_tf == idCheval).first()
 
-    if cheval:
-        infos = get_complete_info (cheval.id_tf, db)
-
     if not cheval:
         raise HTTPException(status_code=404, detail=f"Le cheval n'est pas un trotteur français !")
 
-    return infos
+    return get_complete_info(cheval)
 # ----------------------------------------------------------------------------------------------------------------------------------------------------------|
 
 
 
-# ------------------------------------------------------ Endpoint pour récupérer les stats d'un cheval -----------------------------------------------------|
-@app.get(
-    "/stat-cheval/{nomCheval}",
-    response_model=schemas.ChevalResponse,
-    summary="Obtenir les statistiques PMU d'un cheval quand elle sont dispos",
-    description="Récupère les statistiques détaillées d'un cheval spécifique, y compris le nombre de courses, la vitesse moyenne, les positions obtenues et les gains totaux.",
-    tags=["Consultation des informations chevaux"]
+# ------------------------------------------------------ Endpoint pour récupérer les infos de plusieurs chevaux en une requête ------------------------------|
+@app.post(
+    "/infos-chevaux",
+    response_model=schemas.InfosLotResponse,
+    summary="Obtenir les informations de plusieurs chevaux de la race trotteur français",
+    description=f"Récupère en une seule requête les informations de chevaux identifiés par leurs identifiants et/ou leurs noms (au plus {TAILLE_MAX_LOT} au total). Les résultats sont indexés par la valeur fournie en entrée.",
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("leger", cout=5))]
 )
-def get_stat_cheval_by_name(nomCheval: str, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
-    # Récupération du nom et vérification de l'existence du cheval dans les courses
-    nom_cheval_normalise = nomCheval.upper()
-    db_cheval = db.query(models.ParticipationsAuxCourses).filter(models.ParticipationsAuxCourses.nom == nom_cheval_normalise, models.ParticipationsAuxCourses.race == "TROTTEUR FRANCAIS").order_by(desc(models.ParticipationsAuxCourses.id_participation)).first()
+def get_infos_chevaux(lot: schemas.InfosLotRequest, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    ids = list(dict.fromkeys(lot.ids))
+    noms = list(dict.fromkeys(lot.noms))
+    if len(ids) + len(noms) > TAILLE_MAX_LOT:
+        raise HTTPException(status_code=400, detail=f"Le lot ne peut pas dépasser {TAILLE_MAX_LOT} chevaux")
+
+    # Résolution des identifiants et des noms en une seule requête IN
+    noms_normalises = {nom: nom.upper() for nom in noms}
+    chevaux = []
+    if ids or noms:
+        chevaux = db.query(models.ChevauxTrotteurFrancais).filter(or_(
+            models.ChevauxTrotteurFrancais.id_tf.in_(ids),
+            models.ChevauxTrotteurFrancais.nom_tf.in_(set(noms_normalises.values()))
+        )).all()
+
+    infos_par_id = {cheval.id_tf: get_complete_info(cheval) for cheval in chevaux}
+    infos_par_nom = {infos.nom: infos for infos in infos_par_id.values()}
+
+    return schemas.InfosLotResponse(
+        parId={id_cheval: infos_par_id[id_cheval] for id_cheval in ids if id_cheval in infos_par_id},
+        parNom={nom: infos_par_nom[nom_normalise] for nom, nom_normalise in noms_normalises.items() if nom_normalise in infos_par_nom},
+        idsIntrouvables=[id_cheval for id_cheval in ids if id_cheval not in infos_par_id],
+        nomsIntrouvables=[nom for nom, nom_normalise in noms_normalises.items() if nom_normalise not in infos_par_nom]
+    )
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------|
+
+
+
+# ------------------------------------------------------ Endpoint pour récupérer les stats d'un cheval -----------------------------------------------------|
+def get_complete_stat_cheval(nom_cheval_normalise: str, db: Session, champs: Optional[Set[str]] = None):
+    def demande(*noms):
+        return champs is None or any(nom in champs for nom in noms)
+
+    # Vérification de l'existence du cheval dans les courses (seules les colonnes utiles sont chargées)
+    db_cheval = (db.query(models.ParticipationsAuxCourses)
+                 .options(load_only(models.ParticipationsAuxCourses.nom, models.ParticipationsAuxCourses.nombre_courses))
+                 .filter(models.ParticipationsAuxCourses.nom == nom_cheval_normalise, models.ParticipationsAuxCourses.race == "TROTTEUR FRANCAIS")
+                 .order_by(desc(models.ParticipationsAuxCourses.id_participation)).first())
     if db_cheval is None:
         raise HTTPException(status_code=404, detail="Le cheval n'a pas de courses enregistrées")
 
-    # Récupération du nombre de course et calcul d'une précision
-    nombre_courses_enregistrer = db.query(models.ParticipationsAuxCourses).filter(models.ParticipationsAuxCourses.nom == nom_cheval_normalise).count()
-    nombre_courses_total = db_cheval.nombre_courses
-    precision = (nombre_courses_enregistrer / nombre_courses_total) * 100 if nombre_courses_total > 0 else 0
+    valeurs = {
+        "nomCheval": db_cheval.nom,
+        "nombreCoursesTotal": db_cheval.nombre_courses,
+    }
 
-    # Récupération des courses du cheval
-    query = (db.query(models.Courses, models.ParticipationsAuxCourses)
-             .join(models.ParticipationsAuxCourses, models.Courses.id_course == models.ParticipationsAuxCourses.id_course)
+    # Récupération du nombre de course et calcul d'une précision
+    if demande("nombreCoursesEnregistrer", "precisionPercent"):
+        nombre_courses_enregistrer = db.query(models.ParticipationsAuxCourses).filter(models.ParticipationsAuxCourses.nom == nom_cheval_normalise).count()
+        nombre_courses_total = db_cheval.nombre_courses
+        valeurs["nombreCoursesEnregistrer"] = nombre_courses_enregistrer
+        valeurs["precisionPercent"] = (nombre_courses_enregistrer / nombre_courses_total) * 100 if nombre_courses_total > 0 else 0
+
+    # Calcul de la vitesse moyenne à partir du cube précalculé (colonnes numériques temps_obtenu)
+    if demande("vitesseMoyenneKmh"):
+        valeurs["vitesseMoyenneKmh"] = vitesse_moyenne_globale(cube_vitesses.obtenir(db, nom_cheval_normalise))
+
+    champs_places = ("nombrePremier", "nombreDeuxieme", "nombreTroisieme", "nombreQuatrieme", "nombreCinquieme", "nombreDisqualifications", "placeMoyenne")
+    if not demande(*champs_places, "montantTotalGagne"):
+        return valeurs
+
+    # Récupération des places du cheval et des montants offerts, sans charger les lignes complètes des courses
+    colonnes = [models.ParticipationsAuxCourses.place_dans_la_course]
+    if demande("montantTotalGagne"):
+        colonnes += [models.Courses.montant_offert_1er, models.Courses.montant_offert_2eme, models.Courses.montant_offert_3eme,
+                     models.Courses.montant_offert_4eme, models.Courses.montant_offert_5eme]
+    query = (db.query(*colonnes)
+             .join(models.Courses, models.Courses.id_course == models.ParticipationsAuxCourses.id_course)
              .filter(models.ParticipationsAuxCourses.nom == nom_cheval_normalise, models.ParticipationsAuxCourses.race == "TROTTEUR FRANCAIS"))
-    results = query.all()
-
-    # Convertir les résultats de la jointure en DataFrame
-    data = []
-    for course, participation in results:
-        row = {**course.__dict__, **participation.__dict__}
-        row.pop('_sa_instance_state', None)  # Retirer l'état de SQLAlchemy
-        data.append(row)
-    df_courses = pd.DataFrame(data)
-    print(df_courses)
-
-    # Calcul de la vitesse moyenne
-    df_courses['temps_en_secondes'] = df_courses['temps_obtenu_en_minute'].apply(convertir_temps_en_secondes)
-    df_courses['vitesse'] = df_courses['distance'] / df_courses['temps_en_secondes']  # Calculer la vitesse (distance en mètres / temps en secondes) en m/s
-    df_courses['vitesse_km_h'] = df_courses['vitesse'] * 3.6  # Convertir la vitesse en km/h (1 m/s = 3.6 km/h)
-    moyenne_vitesse = df_courses['vitesse_km_h'].mean()
-    if pd.isna(moyenne_vitesse):
-        moyenne_vitesse = 0.0
-    else:
-        moyenne_vitesse = round(moyenne_vitesse, 2)  # Calculer la moyenne des vitesses en km/h
+    df_courses = pd.DataFrame(query.all(), columns=[colonne.key for colonne in colonnes])
 
     # Calculer le nombre de fois où le cheval est premier, deuxième, etc
-    nombre_premier = df_courses[df_courses['place_dans_la_course'] == 1].shape[0]
-    nombre_deuxieme = df_courses[df_courses['place_dans_la_course'] == 2].shape[0]
-    nombre_troisieme = df_courses[df_courses['place_dans_la_course'] == 3].shape[0]
-    nombre_quatrieme = df_courses[df_courses['place_dans_la_course'] == 4].shape[0]
-    nombre_cinquieme = df_courses[df_courses['place_dans_la_course'] == 5].shape[0]
-    nombre_disqualifications = df_courses['place_dans_la_course'].isnull().sum()
-    place_moyenne = df_courses['place_dans_la_course'].mean()
-    if pd.isna(place_moyenne):
-        place_moyenne = 0.0
-    else:
-        place_moyenne = round(place_moyenne, 2)
+    if demande(*champs_places):
+        valeurs["nombrePremier"] = int((df_courses['place_dans_la_course'] == 1).sum())
+        valeurs["nombreDeuxieme"] = int((df_courses['place_dans_la_course'] == 2).sum())
+        valeurs["nombreTroisieme"] = int((df_courses['place_dans_la_course'] == 3).sum())
+        valeurs["nombreQuatrieme"] = int((df_courses['place_dans_la_course'] == 4).sum())
+        valeurs["nombreCinquieme"] = int((df_courses['place_dans_la_course'] == 5).sum())
+        valeurs["nombreDisqualifications"] = int(df_courses['place_dans_la_course'].isnull().sum())
+        place_moyenne = df_courses['place_dans_la_course'].mean()
+        valeurs["placeMoyenne"] = 0.0 if pd.isna(place_moyenne) else round(float(place_moyenne), 2)
 
     # Calculer le montant total gagné
-    montant_total_gagne = (
-        df_courses[df_courses['place_dans_la_course'] == 1]['montant_offert_1er'].sum() +
-        df_courses[df_courses['place_dans_la_course'] == 2]['montant_offert_2eme'].sum() +
-        df_courses[df_courses['place_dans_la_course'] == 3]['montant_offert_3eme'].sum() +
-        df_courses[df_courses['place_dans_la_course'] == 4]['montant_offert_4eme'].sum() +
-        df_courses[df_courses['place_dans_la_course'] == 5]['montant_offert_5eme'].sum()
+    if demande("montantTotalGagne"):
+        valeurs["montantTotalGagne"] = int(
+            df_courses[df_courses['place_dans_la_course'] == 1]['montant_offert_1er'].sum() +
+            df_courses[df_courses['place_dans_la_course'] == 2]['montant_offert_2eme'].sum() +
+            df_courses[df_courses['place_dans_la_course'] == 3]['montant_offert_3eme'].sum() +
+            df_courses[df_courses['place_dans_la_course'] == 4]['montant_offert_4eme'].sum() +
+            df_courses[df_courses['place_dans_la_course'] == 5]['montant_offert_5eme'].sum()
+        )
+
+    return valeurs
+@app.get(
+    "/stat-cheval/{nomCheval}",
+    response_model=schemas.ChevalResponse,
+    summary="Obtenir les statistiques PMU d'un cheval quand elle sont dispos",
+    description="Récupère les statistiques détaillées d'un cheval spécifique, y compris le nombre de courses, la vitesse moyenne, les positions obtenues et les gains totaux.",
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("lourd", cout=5))]
+)
+def get_stat_cheval_by_name(nomCheval: str, fields: Optional[str] = Query(None, description=DESCRIPTION_FIELDS), db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    nom_cheval_normalise = nomCheval.upper()
+    champs = parse_fields(fields, schemas.ChevalResponse)
+
+    valeurs = get_stat_cheval_en_cache(nom_cheval_normalise, db, champs)
+
+    return construire_reponse(schemas.ChevalResponse, valeurs, champs)
+
+def get_stat_cheval_en_cache(nom_cheval_normalise: str, db: Session, champs: Optional[Set[str]] = None):
+    # Clé complète (nom, None) réservée aux statistiques complètes, qui servent aussi les réponses partielles
+    cle_champs = tuple(sorted(champs)) if champs is not None else None
+    cle_complete = (nom_cheval_normalise, None)
+    cle_cache = cle_complete if champs is None else (nom_cheval_normalise, cle_champs)
+    for cle in dict.fromkeys((cle_complete, cle_cache)):
+        valeurs = cache_stats.obtenir(cle)
+        if valeurs is not ABSENT:
+            return valeurs
+
+    # Les requêtes identiques concurrentes partagent un seul calcul, dans la limite des calculs lourds simultanés
+    valeurs = coalesceur.executer(
+        ("stat-cheval", nom_cheval_normalise, cle_champs),
+        lambda: limiteur_calcul.executer("stat-cheval", lambda: get_complete_stat_cheval(nom_cheval_normalise, db, champs))
     )
+    # Un calcul partiel n'est jamais enregistré sous la clé complète
+    cache_stats.enregistrer(cle_cache, valeurs)
+    return valeurs
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------|
+
+
+
+# ------------------------------------------------------ Endpoint pour récupérer les vitesses d'un cheval par hippodrome, distance et discipline -----------|
+@app.get(
+    "/stat-cheval/{nomCheval}/vitesses",
+    response_model=schemas.VitessesChevalResponse,
+    summary="Obtenir les vitesses d'un cheval par hippodrome, tranche de distance et discipline",
+    description="Récupère les vitesses moyennes, maximales et les réductions kilométriques d'un cheval, segmentées par hippodrome, tranche de distance et discipline.",
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("lourd", cout=3))]
+)
+def get_vitesses_cheval_by_name(nomCheval: str, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    nom_cheval_normalise = nomCheval.upper()
+    segments = limiteur_calcul.executer("stat-cheval-vitesses", lambda: cube_vitesses.obtenir(db, nom_cheval_normalise))
+    if not segments:
+        raise HTTPException(status_code=404, detail="Le cheval n'a pas de courses enregistrées")
 
-    return schemas.ChevalResponse(
-        nomCheval=db_cheval.nom,
-        nombreCoursesEnregistrer=nombre_courses_enregistrer,
-        nombreCoursesTotal=db_cheval.nombre_courses,
-        precisionPercent=precision,
-        vitesseMoyenneKmh=moyenne_vitesse,
-        nombrePremier=nombre_premier,
-        nombreDeuxieme=nombre_deuxieme,
-        nombreTroisieme=nombre_troisieme,
-        nombreQuatrieme=nombre_quatrieme,
-        nombreCinquieme=nombre_cinquieme,
-        nombreDisqualifications=nombre_disqualifications,
-        placeMoyenne=place_moyenne,
-        montantTotalGagne=montant_total_gagne
+    return schemas.VitessesChevalResponse(
+        nomCheval=nom_cheval_normalise,
+        vitesseMoyenneKmh=vitesse_moyenne_globale(segments),
+        segments=[schemas.VitesseSegmentResponse(**segment) for segment in segments]
     )
 # ----------------------------------------------------------------------------------------------------------------------------------------------------------|
 
@@ -304,7 +464,8 @@ def get_complete_info_parents(nom: str, child_birthdate: int, db: Session, depth
     response_model=schemas.GenealogieResponse,
     summary="Obtenir la généalogie d'un cheval de la race trotteur français",
     description="Récupère la généalogie complète d'un cheval spécifique, y compris les informations sur les parents et ancêtres jusqu'à une certaine profondeur.",
-    tags=["Consultation des informations chevaux"]
+    tags=["Consultation des informations chevaux"],
+    dependencies=[Depends(admission("lourd", cout=cout_genealogie))]
 )
 def get_genealogie_cheval(nomCheval: str, idCheval: int, depth: int = 1, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
 
@@ -319,9 +480,96 @@ def get_genealogie_cheval(nomCheval: str, idCheval: int, depth: int = 1, db: Ses
     if not cheval:
         raise HTTPException(status_code=404, detail="Cheval non trouvé dans ChevauxTrotteurFrancais")
 
-    infos = get_complete_info_enfant(cheval.nom_tf, db, depth)
+    infos = get_genealogie_en_cache(cheval.nom_tf, depth, db)
 
     return infos
+
+def get_genealogie_en_cache(nom: str, depth: int, db: Session):
+    infos = cache_genealogies.obtenir((nom, depth))
+    if infos is not ABSENT:
+        return infos
+
+    # Les requêtes identiques concurrentes partagent un seul calcul, dans la limite des calculs lourds simultanés
+    infos = coalesceur.executer(
+        ("genealogie-cheval", nom, depth),
+        lambda: limiteur_calcul.executer("genealogie-cheval", lambda: get_complete_info_enfant(nom, db, depth))
+    )
+    cache_genealogies.enregistrer((nom, depth), infos)
+    return infos
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------|
+
+
+
+# ------------------------------------------------------ Endpoint pour consulter les métriques de l'API ---------------------------------------------------|
+@app.get(
+    "/metriques",
+    summary="Obtenir les métriques internes de l'API",
+    description="Récupère les compteurs internes de l'API, notamment le nombre de requêtes identiques regroupées sur un seul calcul et l'occupation des calculs lourds.",
+    tags=["Supervision"]
+)
+def get_metriques(current_user: str = Depends(get_current_user)):
+    return {
+        "coalescence": coalesceur.metriques(),
+        "execution": limiteur_calcul.metriques(),
+        "replicas": database.routeur_lecture.etat(),
+        "admission": controle_admission.metriques(),
+        "caches": {
+            "vitesses": cube_vitesses.metriques(),
+            "stats": cache_stats.metriques(),
+            "genealogies": cache_genealogies.metriques(),
+            "pages": cache_pages.metriques(),
+        },
+        "prechauffage": prechauffage.etat(),
+    }
+# ----------------------------------------------------------------------------------------------------------------------------------------------------------|
+
+
+
+# ------------------------------------------------------ Préchauffage des caches et disponibilité de l'instance --------------------------------------------|
+def prechauffer_caches(etat):
+    db = database.routeur_lecture.session()
+    try:
+        # Premières pages de la liste des chevaux
+        for page in range(1, PRECHAUFFAGE_PAGES + 1):
+            if etat.temps_ecoule():
+                return
+            get_page_chevaux(page, PRECHAUFFAGE_TAILLE_PAGE, db)
+            etat.compter()
+
+        # Chevaux les plus courus : cube des vitesses en une requête, puis statistiques et généalogies
+        noms = [nom for (nom,) in (db.query(models.ParticipationsAuxCourses.nom)
+                                   .filter(models.ParticipationsAuxCourses.race == "TROTTEUR FRANCAIS")
+                                   .group_by(models.ParticipationsAuxCourses.nom)
+                                   .order_by(desc(func.count(models.ParticipationsAuxCourses.id_participation)))
+                                   .limit(PRECHAUFFAGE_NOMBRE_CHEVAUX))]
+        if noms and not etat.temps_ecoule():
+            cube_vitesses.precalculer(db, noms)
+
+        for nom in noms:
+            for prechauffer in (lambda: get_stat_cheval_en_cache(nom, db),
+                                lambda: get_genealogie_en_cache(nom, PRECHAUFFAGE_PROFONDEUR, db)):
+                if etat.temps_ecoule():
+                    return
+                try:
+                    prechauffer()
+                    etat.compter()
+                except HTTPException:
+                    # Cheval absent de la table trotteur français ou limite des calculs lourds atteinte
+                    etat.compter(reussi=False)
+    finally:
+        db.close()
+
+@app.get(
+    "/ready",
+    summary="Savoir si l'instance est prête à recevoir du trafic",
+    description="Renvoie 200 une fois le préchauffage des caches terminé (ou son budget de temps épuisé), 503 tant qu'il est en cours.",
+    tags=["Supervision"]
+)
+def get_ready():
+    etat = prechauffage.etat()
+    if not etat["pret"]:
+        return JSONResponse(status_code=503, content=etat)
+    return etat
 # ----------------------------------------------------------------------------------------------------------------------------------------------------------|
 
 
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+
+# Activation du préchauffage des caches au démarrage
+PRECHAUFFAGE_ACTIF = os.getenv("PRECHAUFFAGE_ACTIF", "true").lower() in ("1", "true", "oui")
+
+# Budget de temps (en secondes) au-delà duquel le préchauffage s'arrête et l'instance est déclarée prête
+PRECHAUFFAGE_BUDGET = float(os.getenv("PRECHAUFFAGE_BUDGET", 60))
+
+# Périmètre du préchauffage
+PRECHAUFFAGE_NOMBRE_CHEVAUX = int(os.getenv("PRECHAUFFAGE_NOMBRE_CHEVAUX", 50))
+PRECHAUFFAGE_PROFONDEUR = int(os.getenv("PRECHAUFFAGE_PROFONDEUR", 3))
+PRECHAUFFAGE_PAGES = int(os.getenv("PRECHAUFFAGE_PAGES", 3))
+PRECHAUFFAGE_TAILLE_PAGE = int(os.getenv("PRECHAUFFAGE_TAILLE_PAGE", 10))
+
+
+# ---- Préchauffage exécuté en arrière-plan, dont l'état conditionne l'endpoint /ready
+class Prechauffage:
+    def __init__(self, budget: float = PRECHAUFFAGE_BUDGET):
+        self.budget = budget
+        self._termine = False
+        self.budget_depasse = False
+        self.elements = 0
+        self.erreurs = 0
+        self.duree = None
+        self._echeance = None
+        self._thread = None
+
+    @property
+    def pret(self):
+        # L'instance est prête dès la fin du préchauffage ou l'épuisement du budget, même si une étape lente est en cours
+        return self._termine or self.temps_ecoule()
+
+    @pret.setter
+    def pret(self, valeur: bool):
+        self._termine = valeur
+
+    def temps_ecoule(self):
+        # Retourne True quand le budget est épuisé : les tâches doivent alors s'arrêter
+        if not self._termine and self._echeance is not None and time.monotonic() >= self._echeance:
+            self.budget_depasse = True
+        return self.budget_depasse
+
+    def compter(self, reussi: bool = True):
+        if reussi:
+            self.elements += 1
+        else:
+            self.erreurs += 1
+
+    def _executer(self, taches):
+        debut = time.monotonic()
+        try:
+            taches(self)
+        except Exception as erreur:
+            self.erreurs += 1
+            print(f"Cache warm-up failed: {erreur}")
+        finally:
+            self.duree = round(time.monotonic() - debut, 2)
+            self._termine = True
+            print(f"Cache warm-up finished in {self.duree}s ({self.elements} items, {self.erreurs} errors)")
+
+    def demarrer(self, taches):
+        if self._thread is not None:
+            return
+        self._echeance = time.monotonic() + self.budget
+        self._thread = threading.Thread(target=self._executer, args=(taches,), name="prechauffage", daemon=True)
+        self._thread.start()
+
+    def etat(self):
+        return {
+            "pret": self.pret,
+            "budgetDepasse": self.temps_ecoule(),
+            "elements": self.elements,
+            "erreurs": self.erreurs,
+            "dureeSecondes": self.duree,
+        }
+
+
+# Sans préchauffage, l'instance est prête dès le démarrage
+prechauffage = Prechauffage()
+prechauffage.pret = not PRECHAUFFAGE_ACTIF
@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 # ---- Endpoint stats-ifce
 class StatsIfceResponse(BaseModel):
@@ -11,6 +11,19 @@ class StatsIfceResponse(BaseModel):
 
 
 # ---- Reponse de base
+# Correspondance entre les champs de la réponse et les colonnes de la table chevaux trotteur français
+COLONNES_INFOS = {
+    "id": "id_tf",
+    "nom": "nom_tf",
+    "sexe": "sexe_tf",
+    "couleur": "couleur_tf",
+    "dateDeNaissance": "annee_naissance_tf",
+    "naisseur": "naisseur_tf",
+    "lienIfce": "lien_ifce_tf",
+    "pere": "pere_tf",
+    "mere": "mere_tf",
+}
+
 class InfosResponse(BaseModel):
     id: int
     nom: str
@@ -37,6 +50,19 @@ class InfosResponse(BaseModel):
         )
 
 
+# ---- Endpoint infos-chevaux (lot)
+class InfosLotRequest(BaseModel):
+    ids: List[int] = []
+    noms: List[str] = []
+
+
+class InfosLotResponse(BaseModel):
+    parId: Dict[int, InfosResponse]
+    parNom: Dict[str, InfosResponse]
+    idsIntrouvables: List[int]
+    nomsIntrouvables: List[str]
+
+
 # ---- Endpoint pagination
 class PaginationResponse(BaseModel):
     total_results: int
@@ -63,6 +89,25 @@ class ChevalResponse(BaseModel):
     montantTotalGagne: int
 
 
+# ---- Endpoint stat-cheval/vitesses
+class VitesseSegmentResponse(BaseModel):
+    codeHippodrome: Optional[str] = None
+    trancheDistance: str
+    discipline: Optional[str] = None
+    nombreCourses: int
+    nombreCoursesChronometrees: int
+    vitesseMoyenneKmh: Optional[float] = None
+    vitesseMaxKmh: Optional[float] = None
+    reductionKilometriqueMoyenne: Optional[float] = None
+    meilleureReductionKilometrique: Optional[float] = None
+
+
+class VitessesChevalResponse(BaseModel):
+    nomCheval: str
+    vitesseMoyenneKmh: float
+    segments: List[VitesseSegmentResponse]
+
+
 # ---- Lié au endpoint de généalogie
 class GenealogieResponse(BaseModel):
     id: int
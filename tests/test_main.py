@@ -2,9 +2,20 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from app.main import app, get_db, convertir_temps_en_secondes
+from app.main import app, get_db
 from app import models, schemas, database
+from app.coalescence import Coalesceur
+from app.cube_vitesses import cube_vitesses
+from app.cache import cache_stats, cache_pages
+from app.execution import LimiteurCalcul
+from app.database import RouteurLecture
+from app.admission import ControleAdmission, SeauxMemoire, SeauxSQLite
+from app.prechauffage import Prechauffage, prechauffage
+from fastapi import HTTPException
 from datetime import date, time
+import threading
+import sqlite3
+from time import monotonic, sleep
 
 # Configuration de la base de données pour les tests
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -45,7 +56,8 @@ def setup_database():
     # Ajouter des courses
     courses = [
         models.Courses(id_course=1, id_reunion="R1", libelle="Course 1", libelle_court="C1", heure_depart=time(12, 0), parcours="P", distance=2000, distance_unit="m", corde="C", discipline="D", specialite_1="S1", specialite_2="S2", condition_sexe="CS", conditions="C", statut="S", categorie_statut="CS", duree_course=120, duree_course_en_minute="2m 0s", montant_prix=1000, grand_prix_national_trot=True, nombre_declares_partants=10, montant_total_offert=2000, premier=1, montant_offert_1er=1000, deuxieme=2, montant_offert_2eme=500, troisieme=3, montant_offert_3eme=300, quatrieme=4, montant_offert_4eme=200, cinquieme=5, montant_offert_5eme=100, incidents_type="IT", incidents_participants="IP"),
-        models.Courses(id_course=2, id_reunion="R1", libelle="Course 2", libelle_court="C2", heure_depart=time(14, 0), parcours="P", distance=1500, distance_unit="m", corde="C", discipline="D", specialite_1="S1", specialite_2="S2", condition_sexe="CS", conditions="C", statut="S", categorie_statut="CS", duree_course=90, duree_course_en_minute="1m 30s", montant_prix=800, grand_prix_national_trot=False, nombre_declares_partants=8, montant_total_offert=1600, premier=1, montant_offert_1er=800, deuxieme=2, montant_offert_2eme=400, troisieme=3, montant_offert_3eme=200, quatrieme=4, montant_offert_4eme=100, cinquieme=5, montant_offert_5eme=50, incidents_type="IT", incidents_participants="IP")
+        models.Courses(id_course=2, id_reunion="R1", libelle="Course 2", libelle_court="C2", heure_depart=time(14, 0), parcours="P", distance=1500, distance_unit="m", corde="C", discipline="D", specialite_1="S1", specialite_2="S2", condition_sexe="CS", conditions="C", statut="S", categorie_statut="CS", duree_course=90, duree_course_en_minute="1m 30s", montant_prix=800, grand_prix_national_trot=False, nombre_declares_partants=8, montant_total_offert=1600, premier=1, montant_offert_1er=800, deuxieme=2, montant_offert_2eme=400, troisieme=3, montant_offert_3eme=200, quatrieme=4, montant_offert_4eme=100, cinquieme=5, montant_offert_5eme=50, incidents_type="IT", incidents_participants="IP"),
+        models.Courses(id_course=3, id_reunion="R1", libelle="Course 3", distance=2100, distance_unit="m", discipline="D")
     ]
     db.add_all(courses)
     db.commit()
@@ -60,8 +72,9 @@ def setup_database():
 
     # Ajouter des participations aux courses
     participations = [
-        models.ParticipationsAuxCourses(id_participation=1, id_course=1, nom="TEST_CHEVAL_1", race="TROTTEUR FRANCAIS", nombre_courses=10),
-        models.ParticipationsAuxCourses(id_participation=2, id_course=2, nom="TEST_CHEVAL_2", race="TROTTEUR FRANCAIS", nombre_courses=8)
+        models.ParticipationsAuxCourses(id_participation=1, id_course=1, nom="TEST_CHEVAL_1", race="TROTTEUR FRANCAIS", nombre_courses=10, temps_obtenu=150000, reduction_kilometrique=75000),
+        models.ParticipationsAuxCourses(id_participation=2, id_course=2, nom="TEST_CHEVAL_2", race="TROTTEUR FRANCAIS", nombre_courses=8),
+        models.ParticipationsAuxCourses(id_participation=3, id_course=3, nom="TEST_CHEVAL_RECUL", race="TROTTEUR FRANCAIS", nombre_courses=1, handicap_distance=2125, temps_obtenu=157500, reduction_kilometrique=74100)
     ]
     db.add_all(participations)
     db.commit()
@@ -89,6 +102,14 @@ def test_get_chevaux(setup_database):
     assert data["current_page"] == 1
     assert len(data["results"]) == 2
 
+def test_get_chevaux_grande_page_non_mise_en_cache(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    entrees = cache_pages.metriques()["entrees"]
+    response = client.get("/chevaux/?page=1&page_size=100000", headers=headers)
+    assert response.status_code == 200
+    assert cache_pages.metriques()["entrees"] == entrees
+
 def test_get_stats_ifce(setup_database):
     access_token = get_access_token(client)
     headers = {"Authorization": f"Bearer {access_token}"}
@@ -109,6 +130,17 @@ def test_get_infos_cheval(setup_database):
     assert data["nom"] == "TEST_CHEVAL_1"
     assert data["sexe"] == "M"
 
+def test_get_infos_chevaux(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.post("/infos-chevaux", json={"ids": [1, 99], "noms": ["test_cheval_2", "INCONNU"]}, headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["parId"]["1"]["nom"] == "TEST_CHEVAL_1"
+    assert data["parNom"]["test_cheval_2"]["id"] == 2
+    assert data["idsIntrouvables"] == [99]
+    assert data["nomsIntrouvables"] == ["INCONNU"]
+
 def test_get_stat_cheval_by_name(setup_database):
     access_token = get_access_token(client)
     headers = {"Authorization": f"Bearer {access_token}"}
@@ -118,7 +150,305 @@ def test_get_stat_cheval_by_name(setup_database):
     assert data["nomCheval"] == "TEST_CHEVAL_1"
     assert data["nombreCoursesEnregistrer"] == 1
 
-def test_convertir_temps_en_secondes():
-    assert convertir_temps_en_secondes("1m 30s") == 90
-    assert convertir_temps_en_secondes("0m 45s") == 45
-    assert convertir_temps_en_secondes("0m 0s") == None
+def test_get_chevaux_fields(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/chevaux/?page=1&page_size=10&fields=nom", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_results"] == 2
+    assert data["results"][0] == {"nom": "TEST_CHEVAL_1"}
+
+def test_get_stat_cheval_by_name_fields(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/stat-cheval/TEST_CHEVAL_1?fields=nomCheval,nombrePremier", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"nomCheval": "TEST_CHEVAL_1", "nombrePremier": 0}
+
+    response = client.get("/stat-cheval/TEST_CHEVAL_1?fields=inconnu", headers=headers)
+    assert response.status_code == 400
+
+    response = client.get("/stat-cheval/TEST_CHEVAL_1?fields=%20", headers=headers)
+    assert response.status_code == 400
+    response = client.get("/chevaux/?fields=,", headers=headers)
+    assert response.status_code == 400
+
+def test_get_stat_cheval_by_name_partiel_ne_pollue_pas_le_cache(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    cache_stats.vider()
+    response = client.get("/stat-cheval/TEST_CHEVAL_2?fields=nomCheval", headers=headers)
+    assert response.json() == {"nomCheval": "TEST_CHEVAL_2"}
+    response = client.get("/stat-cheval/TEST_CHEVAL_2", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["nombreCoursesEnregistrer"] == 1
+
+def test_get_vitesses_cheval_by_name(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/stat-cheval/TEST_CHEVAL_1/vitesses", headers=headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["vitesseMoyenneKmh"] == 48.0
+    assert len(data["segments"]) == 1
+    segment = data["segments"][0]
+    assert segment["codeHippodrome"] == "CODE"
+    assert segment["trancheDistance"] == "courte"
+    assert segment["discipline"] == "D"
+    assert segment["reductionKilometriqueMoyenne"] == 75.0
+
+def test_get_vitesses_cheval_avec_recul(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = client.get("/stat-cheval/TEST_CHEVAL_RECUL/vitesses", headers=headers)
+    assert response.status_code == 200
+    segment = response.json()["segments"][0]
+    # handicap_distance (2125 m) est la distance parcourue : 2125 m en 157,5 s
+    assert segment["vitesseMoyenneKmh"] == 48.57
+    assert segment["trancheDistance"] == "moyenne"
+    assert segment["reductionKilometriqueMoyenne"] == 74.1
+
+def test_get_vitesses_cheval_inconnu_non_conserve(setup_database):
+    access_token = get_access_token(client)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    entrees = cube_vitesses.metriques()["entrees"]
+    response = client.get("/stat-cheval/CHEVAL_INCONNU/vitesses", headers=headers)
+    assert response.status_code == 404
+    assert cube_vitesses.metriques()["entrees"] == entrees
+
+def test_coalesceur_partage_un_seul_calcul():
+    coalesceur = Coalesceur(timeout=5)
+    demarre = threading.Event()
+    libere = threading.Event()
+    appels = []
+    resultats = []
+
+    def calcul():
+        appels.append(1)
+        demarre.set()
+        libere.wait(5)
+        return "resultat"
+
+    meneur = threading.Thread(target=lambda: resultats.append(coalesceur.executer("cle", calcul)))
+    meneur.start()
+    demarre.wait(5)
+    suiveurs = [threading.Thread(target=lambda: resultats.append(coalesceur.executer("cle", calcul))) for _ in range(3)]
+    for suiveur in suiveurs:
+        suiveur.start()
+    fin = monotonic() + 5
+    while coalesceur.metriques()["dedupliquees"] < 3:
+        if monotonic() > fin:
+            libere.set()
+            pytest.fail("Les requêtes identiques n'ont pas été regroupées")
+        sleep(0.01)
+    libere.set()
+    for thread in [meneur, *suiveurs]:
+        thread.join(5)
+
+    assert len(appels) == 1
+    assert resultats == ["resultat"] * 4
+    assert coalesceur.metriques()["dedupliquees"] == 3
+    assert coalesceur.metriques()["enCours"] == 0
+
+def test_coalesceur_propage_les_erreurs():
+    coalesceur = Coalesceur(timeout=5)
+
+    def calcul():
+        raise ValueError("erreur")
+
+    with pytest.raises(ValueError):
+        coalesceur.executer("cle", calcul)
+    assert coalesceur.metriques()["erreurs"] == 1
+
+def test_limiteur_calcul_rejette_quand_la_limite_est_atteinte():
+    limiteur = LimiteurCalcul(attente_max=0.05)
+    limiteur.configurer("lourd", 1)
+    demarre = threading.Event()
+    libere = threading.Event()
+
+    def calcul():
+        demarre.set()
+        libere.wait(5)
+        return "resultat"
+
+    resultats = []
+    thread = threading.Thread(target=lambda: resultats.append(limiteur.executer("lourd", calcul)))
+    thread.start()
+    demarre.wait(5)
+
+    with pytest.raises(HTTPException) as erreur:
+        limiteur.executer("lourd", calcul)
+    assert erreur.value.status_code == 503
+
+    libere.set()
+    thread.join(5)
+    assert resultats == ["resultat"]
+    metriques = limiteur.metriques()["lourd"]
+    assert metriques["rejetes"] == 1
+    assert metriques["executes"] == 1
+    assert metriques["actifs"] == 0
+
+def test_routeur_lecture_retire_et_restaure_les_replicas(tmp_path):
+    replica_1 = f"sqlite:///{tmp_path / 'replica_1.db'}"
+    replica_2 = f"sqlite:///{tmp_path / 'absent' / 'replica_2.db'}"
+    routeur = RouteurLecture([replica_1, replica_2], TestingSessionLocal)
+
+    # Le second réplica est injoignable tant que son répertoire n'existe pas
+    routeur.verifier()
+    assert [noeud["sain"] for noeud in routeur.etat()] == [True, False]
+    for _ in range(3):
+        session = routeur.session()
+        assert session.get_bind() is routeur.noeuds[0].engine
+        session.close()
+
+    (tmp_path / "absent").mkdir()
+    routeur.verifier()
+    assert [noeud["sain"] for noeud in routeur.etat()] == [True, True]
+    binds = set()
+    for _ in range(2):
+        session = routeur.session()
+        binds.add(session.get_bind())
+        session.close()
+    assert binds == {noeud.engine for noeud in routeur.noeuds}
+
+    # Sans réplica sain, les sessions sont ouvertes sur la base principale
+    for noeud in routeur.noeuds:
+        noeud.sain = False
+    session = routeur.session()
+    assert session.get_bind() is engine
+    session.close()
+
+def test_routeur_lecture_survit_aux_erreurs_inattendues(tmp_path, monkeypatch):
+    routeur = RouteurLecture([f"sqlite:///{tmp_path / 'replica.db'}"], TestingSessionLocal, intervalle=0.01)
+    noeud = routeur.noeuds[0]
+
+    def connexion_en_erreur():
+        raise RuntimeError("erreur inattendue")
+
+    monkeypatch.setattr(noeud.engine, "connect", connexion_en_erreur)
+    routeur.demarrer()
+    fin = monotonic() + 5
+    while noeud.sain and monotonic() < fin:
+        sleep(0.01)
+    assert not noeud.sain
+
+    # Le thread de vérification continue et restaure le réplica une fois l'erreur disparue
+    monkeypatch.undo()
+    while not noeud.sain and monotonic() < fin:
+        sleep(0.01)
+    routeur.arreter()
+    assert noeud.sain
+
+def test_controle_admission_limite_le_debit_par_utilisateur(tmp_path):
+    controle = ControleAdmission(SeauxSQLite(str(tmp_path / "seaux.db")), capacite=10, recharge=0.001)
+    controle.verifier_debit("client_1", "lourd", 9)
+    with pytest.raises(HTTPException) as erreur:
+        controle.verifier_debit("client_1", "lourd", 2)
+    assert erreur.value.status_code == 429
+    assert int(erreur.value.headers["Retry-After"]) >= 1
+
+    # Les seaux sont propres à chaque utilisateur
+    controle.verifier_debit("client_2", "lourd", 9)
+    assert controle.metriques()["lourd"]["rejetsDebit"] == 1
+
+def test_admission_seau_par_client_et_non_par_token(setup_database, monkeypatch):
+    monkeypatch.setattr("app.admission.controle_admission", ControleAdmission(capacite=2, recharge=0.001))
+    for _ in range(2):
+        # Se reconnecter pour obtenir un nouveau token ne recharge pas le seau du client
+        headers = {"Authorization": f"Bearer {get_access_token(client)}"}
+        assert client.get("/infos-cheval/1", headers=headers).status_code == 200
+    response = client.get("/infos-cheval/1", headers={"Authorization": f"Bearer {get_access_token(client)}"})
+    assert response.status_code == 429
+
+    # Derrière un proxy de confiance, l'adresse du client est lue dans l'en-tête configuré
+    monkeypatch.setattr("app.admission.RATE_LIMIT_EN_TETE_CLIENT", "X-Forwarded-For")
+    headers["X-Forwarded-For"] = "203.0.113.7, 10.0.0.1"
+    assert client.get("/infos-cheval/1", headers=headers).status_code == 200
+
+def test_seaux_sqlite_admet_la_requete_si_le_stockage_est_verrouille(tmp_path, monkeypatch):
+    seaux = SeauxSQLite(str(tmp_path / "seaux.db"))
+
+    class ConnexionVerrouillee:
+        def execute(self, requete, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(seaux, "_connexion", ConnexionVerrouillee)
+    assert seaux.consommer("client_1", 1, 10, 1) == 0
+    assert seaux.erreurs == 1
+
+def test_seaux_recharges_sont_oublies(tmp_path, monkeypatch):
+    # Un seau inactif depuis plus que la durée de recharge complète est plein : il n'est pas conservé
+    seaux = SeauxMemoire(capacite=10, recharge=1000, taille_max=2)
+    for client in ("client_1", "client_2", "client_3"):
+        seaux.consommer(client, 1, 10, 1000)
+    assert seaux.metriques()["seaux"] == 2
+
+    monkeypatch.setattr("app.admission.RATE_LIMIT_NETTOYAGE", 0)
+    seaux_sqlite = SeauxSQLite(str(tmp_path / "seaux.db"))
+    seaux_sqlite.consommer("client_1", 1, 10, 1000)
+    seaux_sqlite.consommer("client_2", 1, 10, 1000)
+    assert seaux_sqlite.metriques()["seaux"] == 2
+    sleep(0.02)
+    seaux_sqlite.consommer("client_3", 1, 10, 1000)
+    assert seaux_sqlite.metriques()["seaux"] == 1
+
+def test_controle_admission_deleste_au_dela_de_la_limite():
+    controle = ControleAdmission(limites={"leger": 1}, attente_max=0.05)
+    assert controle.entrer("leger")
+    with pytest.raises(HTTPException) as erreur:
+        controle.entrer("leger")
+    assert erreur.value.status_code == 503
+    assert "Retry-After" in erreur.value.headers
+    controle.sortir("leger")
+    controle.entrer("leger")
+    controle.sortir("leger")
+    assert controle.metriques()["leger"]["rejetsSurcharge"] == 1
+    assert controle.metriques()["leger"]["actifs"] == 0
+
+    # La concurrence des endpoints lourds relève uniquement du limiteur de calcul
+    assert not controle.entrer("lourd")
+    assert controle.metriques()["lourd"]["limite"] is None
+
+def test_prechauffage_respecte_le_budget():
+    etat = Prechauffage(budget=0.05)
+    traites = []
+
+    def taches(etat):
+        while not etat.temps_ecoule():
+            traites.append(1)
+            etat.compter()
+
+    etat.demarrer(taches)
+    etat._thread.join(5)
+    assert etat.pret
+    assert etat.budget_depasse
+    assert etat.elements == len(traites)
+
+def test_prechauffage_pret_a_l_echeance_meme_si_une_etape_bloque():
+    etat = Prechauffage(budget=0.05)
+    libere = threading.Event()
+    etat.demarrer(lambda etat: libere.wait(5))
+    assert not etat.pret
+    fin = monotonic() + 5
+    while not etat.pret and monotonic() < fin:
+        sleep(0.01)
+    assert etat.pret
+    assert etat.etat()["budgetDepasse"]
+    libere.set()
+    etat._thread.join(5)
+
+def test_get_ready():
+    pret = prechauffage.pret
+    try:
+        prechauffage.pret = False
+        assert client.get("/ready").status_code == 503
+        prechauffage.pret = True
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["pret"] is True
+    finally:
+        prechauffage.pret = pret